@@ -20,33 +20,74 @@ import sys
 import argparse
 import os
 from ext4 import Ext4
+from progress import Progress
+
+
+def make_parser():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-v", "--verbose", dest='verbose', help="verbose output",
+                        action='store_true')
+    parser.add_argument("-D", "--directory", dest='directory', type=str, help="set output directory", default=".")
+    parser.add_argument("-S", "--dump-symlink-table", dest='symlinks', type=str, help="Generate symlink table")
+    parser.add_argument("-M", "--dump-metadata", dest='metadata', type=str, help="Generate inode metadata table")
+    parser.add_argument("--verify", dest='verify', help="verify metadata checksums (metadata_csum)",
+                        action='store_true')
+    parser.add_argument("--no-journal-replay", dest='replay', help="do not replay the journal of unclean images",
+                        action='store_false')
+    parser.add_argument("-P", "--progress", dest='progress', help="report progress and ETA to stderr",
+                        action='store_true')
+    parser.add_argument("--status-file", dest='status_file', type=str,
+                        help="periodically write progress as JSON to this file")
+    parser.add_argument("filename", type=str, help="EXT4 device or image")
+
+    add_symlink_options(parser)
+    return parser
+
+
+def add_symlink_options(parser):
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--save-symlinks", help="save symlinks as is (default)", action='store_true')
+    group.add_argument("--text-symlinks", help="save symlinks as text file", action='store_true')
+    group.add_argument("--empty-symlinks", help="save symlinks as empty file", action='store_true')
+    group.add_argument("--skip-symlinks", help="do not save symlinks", action='store_true')
 
 
 class Application(object):
-    def __init__(self):
+    def __init__(self, filename=None, **options):
         self._args = None
         self._ext4 = None
         self._symltbl = None
         self._metatbl = None
-
-    def _parse_args(self):
-        parser = argparse.ArgumentParser()
-
-        parser.add_argument("-v", "--verbose", dest='verbose', help="verbose output",
-                            action='store_true')
-        parser.add_argument("-D", "--directory", dest='directory', type=str, help="set output directory", default=".")
-        parser.add_argument("-S", "--dump-symlink-table", dest='symlinks', type=str, help="Generate symlink table")
-        parser.add_argument("-M", "--dump-metadata", dest='metadata', type=str, help="Generate inode metadata table")
-        parser.add_argument("filename", type=str, help="EXT4 device or image")
-
-        group = parser.add_mutually_exclusive_group()
-        group.add_argument("--save-symlinks", help="save symlinks as is (default)", action='store_true')
-        group.add_argument("--text-symlinks", help="save symlinks as text file", action='store_true')
-        group.add_argument("--empty-symlinks", help="save symlinks as empty file", action='store_true')
-        group.add_argument("--skip-symlinks", help="do not save symlinks", action='store_true')
-
+        self._files = 0
+        self._bytes = 0
+        self._csum_errors = 0
+        self._progress = None
+        self._partial_bytes = 0
+        self._verbose_buf = []
+
+        if filename is not None:
+            self._args = make_parser().parse_args(['--', filename])
+            for key, value in options.items():
+                if not hasattr(self._args, key):
+                    raise TypeError("Unknown option '{}'".format(key))
+                setattr(self._args, key, value)
+
+    @property
+    def files(self):
+        return self._files
+
+    @property
+    def bytes(self):
+        return self._bytes
+
+    @property
+    def checksum_errors(self):
+        return self._csum_errors
+
+    def _parse_args(self, argv=None):
         try:
-            self._args = parser.parse_args()
+            self._args = make_parser().parse_args(argv)
         except SystemExit:
             sys.exit(2)
 
@@ -55,6 +96,7 @@ class Application(object):
         if name is not None:
             path = os.path.join(path, name)
             rpath = rpath + '/' + name
+        self._report_checksum_errors(rpath or '/')
         try:
             os.mkdir(path)
         except FileExistsError:
@@ -66,18 +108,24 @@ class Application(object):
             processed = False
             if self._metatbl is not None:
                 self._write_meta(de, rpath)
+                self._report_checksum_errors(rpath + '/' + de.name)
             if de.type == 1:  # regular file
-                data, atime, mtime = self._ext4.read_file(de.inode)
+                data, atime, mtime = self._ext4.read_file(
+                    de.inode, self._read_progress if self._progress is not None else None)
+                self._partial_bytes = 0
+                self._report_checksum_errors(rpath + '/' + de.name)
                 file = open(os.path.join(path, de.name), 'w+b')
                 file.write(data)
                 file.close()
                 os.utime(file.name, (atime, mtime))
+                self._bytes += len(data)
                 processed = True
             elif de.type == 2:  # directory
                 self._extract_dir(self._ext4.read_dir(de.inode), path, rpath, de.name)
             elif de.type == 7:  # symlink
                 link = os.path.join(path, de.name)
                 link_to = self._ext4.read_link(de.inode)
+                self._report_checksum_errors(rpath + '/' + de.name)
                 if self._symltbl is not None:
                     self._write_symlink(rpath + '/' + de.name, link_to)
                 if self._args.skip_symlinks:
@@ -92,8 +140,30 @@ class Application(object):
                     os.symlink(link_to, link + ".tmp")
                     os.rename(link + ".tmp", link)
                 processed = True
+            if processed:
+                self._files += 1
+                if self._progress is not None:
+                    self._progress.update(self._files, self._bytes)
             if processed and self._args.verbose:
-                print(rpath + '/' + de.name)
+                self._verbose_buf.append(rpath + '/' + de.name)
+                if len(self._verbose_buf) >= 1024:
+                    self._flush_verbose()
+
+    def _read_progress(self, size):
+        self._partial_bytes += size
+        self._progress.update(self._files, self._bytes + self._partial_bytes)
+
+    def _flush_verbose(self):
+        if self._verbose_buf:
+            self._verbose_buf.append('')
+            sys.stdout.write('\n'.join(self._verbose_buf))
+            sys.stdout.flush()
+            self._verbose_buf = []
+
+    def _report_checksum_errors(self, path):
+        for error in self._ext4.pop_checksum_errors():
+            self._csum_errors += 1
+            sys.stderr.write("{path}: {error}\n".format(path=path, error=error))
 
     def _write_symlink(self, link, link_to):
         self._symltbl.write(
@@ -111,20 +181,42 @@ class Application(object):
             ) + os.linesep)
 
     def _do_extract(self):
-        self._ext4 = Ext4(self._args.filename)
-        self._extract_dir(self._ext4.root, self._args.directory)
-
-    def run(self):
-        self._parse_args()
+        self._ext4 = Ext4(self._args.filename, verify=self._args.verify, replay=self._args.replay)
+        if self._args.verify and not self._ext4.verifying:
+            sys.stderr.write("{}: metadata_csum is not enabled, checksums are not verified\n".format(
+                self._args.filename))
+        for error in self._ext4.journal_errors:
+            sys.stderr.write("{}: journal: {}\n".format(self._args.filename, error))
+        try:
+            if self._args.progress or self._args.status_file is not None:
+                total_files, total_symlinks, total_bytes = self._ext4.scan_usage()
+                if not self._args.skip_symlinks:
+                    total_files += total_symlinks
+                self._progress = Progress(total_files, total_bytes,
+                                          stream=sys.stderr if self._args.progress else None,
+                                          status_file=self._args.status_file)
+            self._extract_dir(self._ext4.root, self._args.directory)
+            if self._progress is not None:
+                self._progress.finish()
+        finally:
+            self._flush_verbose()
+            self._ext4.close()
+
+    def run(self, argv=None):
+        if self._args is None:
+            self._parse_args(argv)
 
         if self._args.symlinks is not None:
             self._symltbl = open(self._args.symlinks, "w+")
         if self._args.metadata is not None:
             self._metatbl = open(self._args.metadata, "w+")
 
-        self._do_extract()
+        try:
+            self._do_extract()
+        finally:
+            if self._symltbl is not None:
+                self._symltbl.close()
+            if self._metatbl is not None:
+                self._metatbl.close()
 
-        if self._symltbl is not None:
-            self._symltbl.close()
-        if self._metatbl is not None:
-            self._metatbl.close()
+        return 1 if self._csum_errors else 0
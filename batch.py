@@ -0,0 +1,173 @@
+"""
+    ext4extract - Ext4 data extracting tool
+    Copyright (C) 2017, HexEdit (IFProject)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import sys
+import argparse
+import glob
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from app import Application, add_symlink_options
+
+
+BatchResult = namedtuple('BatchResult', """
+    filename
+    directory
+    error
+    files
+    bytes
+    elapsed
+""")
+
+
+def extract_image(filename, directory, **options):
+    start = time.monotonic()
+    app = None
+    try:
+        app = Application(filename, directory=directory, **options)
+        app.run()
+    except BaseException as e:
+        error = "{}: {}".format(type(e).__name__, e)
+    else:
+        error = None
+        if app.checksum_errors:
+            error = "{} checksum mismatches".format(app.checksum_errors)
+    files = app.files if app is not None else 0
+    size = app.bytes if app is not None else 0
+    return BatchResult(filename, directory, error, files, size, time.monotonic() - start)
+
+
+class BatchApplication(object):
+    def __init__(self):
+        self._args = None
+        self._results = []
+
+    def _parse_args(self, argv=None):
+        parser = argparse.ArgumentParser()
+
+        parser.add_argument("-v", "--verbose", dest='verbose', help="verbose output",
+                            action='store_true')
+        parser.add_argument("-D", "--directory", dest='directory', type=str,
+                            help="set base output directory, each image is extracted into its own subdirectory",
+                            default=".")
+        parser.add_argument("-j", "--jobs", dest='jobs', type=int, help="number of images extracted concurrently",
+                            default=os.cpu_count() or 1)
+        parser.add_argument("-S", "--dump-symlink-table", dest='symlinks', help="Generate symlink table per image",
+                            action='store_true')
+        parser.add_argument("-M", "--dump-metadata", dest='metadata', help="Generate inode metadata table per image",
+                            action='store_true')
+        parser.add_argument("--verify", dest='verify', help="verify metadata checksums (metadata_csum)",
+                            action='store_true')
+        parser.add_argument("--no-journal-replay", dest='replay', help="do not replay the journal of unclean images",
+                            action='store_false')
+        parser.add_argument("images", type=str, nargs='+', help="EXT4 devices, images or glob patterns")
+
+        add_symlink_options(parser)
+
+        try:
+            self._args = parser.parse_args(argv)
+        except SystemExit:
+            sys.exit(2)
+        if self._args.jobs < 1:
+            parser.error("number of jobs must be positive")
+
+    def _collect_images(self):
+        images = []
+        for pattern in self._args.images:
+            matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+            if not matches:
+                sys.stderr.write("{}: no images match\n".format(pattern))
+            for image in matches:
+                if image not in images:
+                    images.append(image)
+        return images
+
+    def _make_jobs(self, images):
+        jobs = []
+        names = set()
+        for image in images:
+            name = os.path.splitext(os.path.basename(image))[0]
+            unique, idx = name, 1
+            while unique in names:
+                unique = "{}.{}".format(name, idx)
+                idx += 1
+            names.add(unique)
+            directory = os.path.join(self._args.directory, unique)
+            options = {
+                'verbose': self._args.verbose,
+                'verify': self._args.verify,
+                'replay': self._args.replay,
+                'save_symlinks': self._args.save_symlinks,
+                'text_symlinks': self._args.text_symlinks,
+                'empty_symlinks': self._args.empty_symlinks,
+                'skip_symlinks': self._args.skip_symlinks,
+            }
+            if self._args.symlinks:
+                options['symlinks'] = directory + ".symlinks"
+            if self._args.metadata:
+                options['metadata'] = directory + ".metadata"
+            jobs.append((image, directory, options))
+        return jobs
+
+    def _report(self, result):
+        if result.error is None:
+            print("OK   {} -> {} ({} files, {:.1f} MiB, {:.2f}s)".format(
+                result.filename, result.directory, result.files, result.bytes / 2 ** 20, result.elapsed))
+        else:
+            print("FAIL {}: {}".format(result.filename, result.error))
+
+    def _summary(self, elapsed):
+        failed = [r for r in self._results if r.error is not None]
+        total_files = sum(r.files for r in self._results)
+        total_bytes = sum(r.bytes for r in self._results)
+        print("{} images, {} failed, {} files, {:.1f} MiB in {:.2f}s ({:.1f} MiB/s, {:.2f} images/s)".format(
+            len(self._results), len(failed), total_files, total_bytes / 2 ** 20, elapsed,
+            total_bytes / 2 ** 20 / elapsed if elapsed else 0.0,
+            len(self._results) / elapsed if elapsed else 0.0))
+        for result in failed:
+            sys.stderr.write("{}: {}\n".format(result.filename, result.error))
+
+    @property
+    def results(self):
+        return self._results
+
+    def run(self, argv=None):
+        self._parse_args(argv)
+        jobs = self._make_jobs(self._collect_images())
+
+        try:
+            os.makedirs(self._args.directory)
+        except FileExistsError:
+            pass
+
+        start = time.monotonic()
+        with ProcessPoolExecutor(max_workers=min(self._args.jobs, max(len(jobs), 1))) as executor:
+            futures = {executor.submit(extract_image, image, directory, **options): (image, directory)
+                       for image, directory, options in jobs}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except BaseException as e:
+                    image, directory = futures[future]
+                    result = BatchResult(image, directory, "{}: {}".format(type(e).__name__, e), 0, 0, 0.0)
+                self._results.append(result)
+                self._report(result)
+        self._summary(time.monotonic() - start)
+
+        return 1 if any(r.error is not None for r in self._results) else 0
@@ -0,0 +1,74 @@
+"""
+    ext4extract - Ext4 data extracting tool
+    Copyright (C) 2017, HexEdit (IFProject)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import sys
+import argparse
+from ext4 import Ext4
+
+
+def block_range(value):
+    first, _, last = value.partition('-')
+    try:
+        first = int(first, 0)
+        last = int(last, 0) if last else first
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid block or block range '{}'".format(value))
+    if last < first:
+        raise argparse.ArgumentTypeError("invalid block range '{}'".format(value))
+    return first, last
+
+
+class BlockMapApplication(object):
+    def __init__(self):
+        self._args = None
+        self._ext4 = None
+
+    def _parse_args(self, argv=None):
+        parser = argparse.ArgumentParser()
+
+        parser.add_argument("--no-journal-replay", dest='replay', help="do not replay the journal of unclean images",
+                            action='store_false')
+        parser.add_argument("filename", type=str, help="EXT4 device or image")
+        parser.add_argument("blocks", type=block_range, nargs='+',
+                            help="physical block number or inclusive range FIRST-LAST")
+
+        try:
+            self._args = parser.parse_args(argv)
+        except SystemExit:
+            sys.exit(2)
+
+    def run(self, argv=None):
+        self._parse_args(argv)
+
+        self._ext4 = Ext4(self._args.filename, replay=self._args.replay)
+        try:
+            self._ext4.build_block_map()
+            for first, last in self._args.blocks:
+                query = str(first) if first == last else "{}-{}".format(first, last)
+                owners = self._ext4.owners_of(first, last)
+                if not owners:
+                    print("blocks=\"{query}\" owner=\"none\"".format(query=query))
+                for owner in owners:
+                    print("blocks=\"{query}\" start=\"{start}\" length=\"{length}\" inode=\"{inode}\" path=\"{path}\"".format(
+                        query=query,
+                        start=owner.start,
+                        length=owner.length,
+                        inode=owner.inode,
+                        path=owner.path))
+        finally:
+            self._ext4.close()
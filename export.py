@@ -0,0 +1,59 @@
+"""
+    ext4extract - Ext4 data extracting tool
+    Copyright (C) 2017, HexEdit (IFProject)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import sys
+import argparse
+import time
+from ext4 import Ext4
+
+
+class ExportApplication(object):
+    def __init__(self):
+        self._args = None
+        self._ext4 = None
+
+    def _parse_args(self, argv=None):
+        parser = argparse.ArgumentParser()
+
+        parser.add_argument("--android-sparse", dest='android_sparse', help="write Android sparse image format",
+                            action='store_true')
+        parser.add_argument("--no-journal-replay", dest='replay', help="do not replay the journal of unclean images",
+                            action='store_false')
+        parser.add_argument("filename", type=str, help="EXT4 device or image")
+        parser.add_argument("output", type=str, help="output image")
+
+        try:
+            self._args = parser.parse_args(argv)
+        except SystemExit:
+            sys.exit(2)
+
+    def run(self, argv=None):
+        self._parse_args(argv)
+
+        start = time.monotonic()
+        self._ext4 = Ext4(self._args.filename, replay=self._args.replay)
+        try:
+            copied, total = self._ext4.export(self._args.output, android_sparse=self._args.android_sparse)
+        finally:
+            self._ext4.close()
+        elapsed = time.monotonic() - start
+        print("{copied}/{total} blocks allocated ({percent:.1f}%), copied in {elapsed:.2f}s".format(
+            copied=copied,
+            total=total,
+            percent=100.0 * copied / total if total else 0.0,
+            elapsed=elapsed))
@@ -0,0 +1,97 @@
+"""
+    ext4extract - Ext4 data extracting tool
+    Copyright (C) 2017, HexEdit (IFProject)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+
+
+BlockOwner = namedtuple('BlockOwner', """
+    start
+    length
+    inode
+    path
+""")
+
+
+class BlockMap(object):
+    """
+    Physical block ranges mapped to owning inodes, kept in parallel arrays sorted by start.
+    _max_ends[i] is the largest range end among the first i + 1 ranges, so it is non-decreasing
+    and the ranges overlapping a query are found with two bisections.
+    """
+
+    def __init__(self):
+        self._starts = array('Q')
+        self._lengths = array('I')
+        self._inodes = array('I')
+        self._max_ends = array('Q')
+        self._paths = {}
+
+    def __len__(self):
+        return len(self._starts)
+
+    def add(self, start, length, inode_num):
+        self._starts.append(start)
+        self._lengths.append(length)
+        self._inodes.append(inode_num)
+
+    def set_path(self, inode_num, path):
+        self._paths[inode_num] = path
+
+    def has_inode(self, inode_num):
+        return inode_num in self._paths
+
+    def _buckets(self):
+        if not self._starts:
+            return []
+        low = min(self._starts)
+        span = max(self._starts) - low + 1
+        count = max(1, len(self._starts) // 1024)
+        buckets = [array('I') for _ in range(count)]
+        for i, start in enumerate(self._starts):
+            buckets[(start - low) * count // span].append(i)
+        return buckets
+
+    def sort(self):
+        # Indices are bucketed by start into compact arrays and each bucket is sorted on its own,
+        # so only one bucket's worth of Python ints exists at any time.
+        starts, lengths, inodes = array('Q'), array('I'), array('I')
+        for bucket in self._buckets():
+            order = sorted(bucket, key=self._starts.__getitem__)
+            starts.extend(map(self._starts.__getitem__, order))
+            lengths.extend(map(self._lengths.__getitem__, order))
+            inodes.extend(map(self._inodes.__getitem__, order))
+        self._starts, self._lengths, self._inodes = starts, lengths, inodes
+        self._max_ends = array('Q', bytes(8 * len(self._starts)))
+        max_end = 0
+        for i, (start, length) in enumerate(zip(self._starts, self._lengths)):
+            max_end = max(max_end, start + length)
+            self._max_ends[i] = max_end
+
+    def overlapping(self, first, last):
+        owners = []
+        for i in range(bisect_right(self._max_ends, first), bisect_right(self._starts, last)):
+            if self._starts[i] + self._lengths[i] > first:
+                owners.append(BlockOwner(self._starts[i], self._lengths[i], self._inodes[i],
+                                         self._paths.get(self._inodes[i])))
+        return owners
+
+    def owner_of(self, block):
+        owners = self.overlapping(block, block)
+        return owners[0] if owners else None
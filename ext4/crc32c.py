@@ -0,0 +1,66 @@
+"""
+    ext4extract - Ext4 data extracting tool
+    Copyright (C) 2017, HexEdit (IFProject)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from struct import Struct
+
+try:
+    import crc32c as _crc32c_ext
+except ImportError:
+    _crc32c_ext = None
+
+
+__CRC32C_POLY__ = 0x82f63b78
+
+
+def _make_tables():
+    tables = [[0] * 256 for _ in range(8)]
+    for n in range(256):
+        crc = n
+        for _ in range(8):
+            crc = (crc >> 1) ^ (__CRC32C_POLY__ if crc & 1 else 0)
+        tables[0][n] = crc
+    for n in range(256):
+        crc = tables[0][n]
+        for k in range(1, 8):
+            crc = tables[0][crc & 0xff] ^ (crc >> 8)
+            tables[k][n] = crc
+    return tables
+
+
+__T0__, __T1__, __T2__, __T3__, __T4__, __T5__, __T6__, __T7__ = _make_tables()
+__QWORDS__ = Struct('<II')
+
+
+def _crc32c_slice8(crc, data):
+    t0, t1, t2, t3, t4, t5, t6, t7 = __T0__, __T1__, __T2__, __T3__, __T4__, __T5__, __T6__, __T7__
+    data = memoryview(data).cast('B')
+    tail = len(data) & 7
+    for lo, hi in __QWORDS__.iter_unpack(data[:len(data) - tail]):
+        lo ^= crc
+        crc = t7[lo & 0xff] ^ t6[(lo >> 8) & 0xff] ^ t5[(lo >> 16) & 0xff] ^ t4[lo >> 24] \
+            ^ t3[hi & 0xff] ^ t2[(hi >> 8) & 0xff] ^ t1[(hi >> 16) & 0xff] ^ t0[hi >> 24]
+    for b in data[len(data) - tail:]:
+        crc = t0[(crc ^ b) & 0xff] ^ (crc >> 8)
+    return crc
+
+
+def crc32c(crc, data):
+    """Raw CRC32C update without pre/post inversion, matching the kernel's crc32c_le() used by ext4."""
+    if _crc32c_ext is not None:
+        return _crc32c_ext.crc32c(data, crc ^ 0xffffffff) ^ 0xffffffff
+    return _crc32c_slice8(crc, data)
@@ -16,19 +16,35 @@
     along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-from struct import unpack
+from struct import pack, unpack, unpack_from
 
 from .structs import *
+from .crc32c import crc32c
 from .direntry import DirEntry
 from .metadata import Metadata
+from .journal import Journal, JournalOverlay
+from .blockmap import BlockMap
+from .sparse import write_sparse_raw, write_android_sparse
+
+
+__READ_CHUNK__ = 16 * 2 ** 20
 
 
 class Ext4(object):
-    def __init__(self, filename=None):
+    def __init__(self, filename=None, verify=False, replay=True):
         self._ext4 = None
         self._superblock = None
         self._block_size = 1024
         self._backup_bgs = []
+        self._verify = verify
+        self._replay = replay
+        self._block_map = None
+        self._journal_errors = []
+        self._csum_seed = None
+        self._csum_errors = []
+        self._csum_failed = set()
+        self._verified_bgs = set()
+        self._inode_seeds = {}
 
         if filename is not None:
             self.load(filename)
@@ -51,11 +67,42 @@ class Ext4(object):
     def _has_sparse_super2(self):
         return bool(self._superblock.s_feature_compat & 0x200)
 
+    @property
+    def _has_metadata_csum(self):
+        return bool(self._superblock.s_feature_ro_compat & 0x400)
+
+    @property
+    def _desc_size(self):
+        if self._superblock.s_feature_incompat & 0x80:
+            return self._superblock.s_desc_size
+        return 32
+
+    @property
+    def _verifying(self):
+        return self._csum_seed is not None
+
+    def _csum_error(self, what, error):
+        if what not in self._csum_failed:
+            self._csum_failed.add(what)
+            self._csum_errors.append(error)
+
+    def _check_csum(self, what, stored, computed):
+        if stored != computed:
+            self._csum_error(what, "{} checksum mismatch (stored {:#x}, computed {:#x})".format(
+                what, stored, computed))
+
     def _read_group_descriptor(self, bg_num):
         gd_offset = (self._superblock.s_first_data_block + 1) * self._block_size \
-                    + (bg_num * self._superblock.s_desc_size)
+                    + (bg_num * self._desc_size)
         self._ext4.seek(gd_offset)
-        return make_group_descriptor(self._ext4.read(32))
+        gd_raw = self._ext4.read(self._desc_size)
+        group_desc = make_group_descriptor(gd_raw[:32])
+        if self._verifying and bg_num not in self._verified_bgs:
+            self._verified_bgs.add(bg_num)
+            csum = crc32c(self._csum_seed, pack('<I', bg_num))
+            csum = crc32c(csum, gd_raw[:0x1e] + b'\0\0' + gd_raw[0x20:])
+            self._check_csum("group descriptor {}".format(bg_num), group_desc.bg_checksum, csum & 0xffff)
+        return group_desc
 
     @staticmethod
     def _test_root(a, b):
@@ -89,25 +136,76 @@ class Ext4(object):
             return True
         return False
 
-    def _read_inode(self, inode_num):
+    def _inode_csum_seed(self, inode_num, inode):
+        csum_seed = self._inode_seeds.get(inode_num)
+        if csum_seed is None:
+            csum_seed = crc32c(self._csum_seed, pack('<II', inode_num, inode.i_generation))
+            self._inode_seeds[inode_num] = csum_seed
+        return csum_seed
+
+    def _verify_inode(self, inode_num, inode_raw):
+        inode = make_inode(inode_raw[:128])
+        has_hi = len(inode_raw) > 128 and unpack('<H', inode_raw[0x80:0x82])[0] >= 4
+        csum_raw = bytearray(inode_raw)
+        csum_raw[0x7c:0x7e] = b'\0\0'
+        stored, = unpack('<H', inode_raw[0x7c:0x7e])
+        if has_hi:
+            csum_raw[0x82:0x84] = b'\0\0'
+            stored |= unpack('<H', inode_raw[0x82:0x84])[0] << 16
+        csum = crc32c(self._inode_csum_seed(inode_num, inode), csum_raw)
+        self._check_csum("inode {}".format(inode_num), stored, csum if has_hi else csum & 0xffff)
+
+    def _read_inode_raw(self, inode_num):
         inode_bg_num = (inode_num - 1) // self._superblock.s_inodes_per_group
         bg_inode_idx = (inode_num - 1) % self._superblock.s_inodes_per_group
         group_desc = self._read_group_descriptor(inode_bg_num)
-        table_start = (inode_bg_num * self._superblock.s_blocks_per_group) \
-            + group_desc.bg_inode_table_lo
-        if not self._bg_has_super(inode_bg_num):
-            table_start -= 2
-        inode_offset = (table_start * self._block_size) \
+        inode_offset = (group_desc.bg_inode_table_lo * self._block_size) \
             + (bg_inode_idx * self._superblock.s_inode_size)
         self._ext4.seek(inode_offset)
-        return make_inode(self._ext4.read(128))
+        inode_raw = self._ext4.read(self._superblock.s_inode_size)
+        if self._verifying and inode_num not in self._inode_seeds:
+            self._verify_inode(inode_num, inode_raw)
+        return inode_raw
 
-    def _read_inode_extra(self, inode_num):
-        inode = self._read_inode(inode_num)
-        extra = self._ext4.read(self._superblock.s_inode_size - 128)
-        return inode, extra
+    def _read_inode(self, inode_num):
+        return make_inode(self._read_inode_raw(inode_num)[:128])
 
-    def _read_extent(self, data, extent_block):
+    def _read_inode_extra(self, inode_num):
+        inode_raw = self._read_inode_raw(inode_num)
+        return make_inode(inode_raw[:128]), inode_raw[128:]
+
+    def _verify_extent_block(self, extent_block, block_num, csum_seed):
+        tail = 12 + 12 * make_extent_header(extent_block[:12]).eh_max
+        stored, = unpack('<I', extent_block[tail:tail + 4])
+        self._check_csum("extent block {}".format(block_num), stored, crc32c(csum_seed, extent_block[:tail]))
+
+    def _verify_dir_block(self, dir_block, inode_num, lblk, csum_seed, indexed):
+        tail_hdr = unpack('<IHBB', dir_block[-12:-4])
+        if tail_hdr == (0, 12, 0, 0xde):
+            stored, = unpack('<I', dir_block[-4:])
+            self._check_csum("inode {} directory block {}".format(inode_num, lblk), stored, crc32c(csum_seed, dir_block[:-12]))
+            return
+        if indexed and lblk == 0:
+            count_offset = 0x20
+        elif indexed and unpack('<IH', dir_block[:6]) == (0, self._block_size):
+            count_offset = 8
+        else:
+            what = "inode {} directory block {}".format(inode_num, lblk)
+            self._csum_error(what, "{} has no checksum tail".format(what))
+            return
+        limit, count = unpack('<HH', dir_block[count_offset:count_offset + 4])
+        tail = count_offset + limit * 8
+        if tail + 8 > len(dir_block):
+            what = "inode {} directory index block {}".format(inode_num, lblk)
+            self._csum_error(what, "{} has no checksum tail".format(what))
+            return
+        stored, = unpack('<I', dir_block[tail + 4:tail + 8])
+        csum = crc32c(csum_seed, dir_block[:count_offset + count * 8])
+        csum = crc32c(csum, dir_block[tail:tail + 4])
+        csum = crc32c(csum, b'\0' * 4)
+        self._check_csum("inode {} directory index block {}".format(inode_num, lblk), stored, csum)
+
+    def _walk_extents(self, extent_block, csum_seed=None, index_blocks=None):
         hdr = make_extent_header(extent_block[:12])
         if hdr.eh_magic != 0xf30a:
             raise RuntimeError("Bad extent magic")
@@ -116,18 +214,29 @@ class Ext4(object):
             raw_offset = 12 + (eex * 12)
             entry_raw = extent_block[raw_offset:raw_offset + 12]
             if hdr.eh_depth == 0:
-                entry = make_extent_entry(entry_raw)
-                _start = entry.ee_block * self._block_size
-                _size = entry.ee_len * self._block_size
-                self._ext4.seek(entry.ee_start_lo * self._block_size)
-                data[_start:_start + _size] = self._ext4.read(_size)
+                yield make_extent_entry(entry_raw)
             else:
                 index = make_extent_index(entry_raw)
+                if index_blocks is not None:
+                    index_blocks.append(index.ei_leaf_lo)
                 self._ext4.seek(index.ei_leaf_lo * self._block_size)
                 lower_block = self._ext4.read(self._block_size)
-                self._read_extent(data, lower_block)
-
-    def _read_data(self, inode):
+                if csum_seed is not None:
+                    self._verify_extent_block(lower_block, index.ei_leaf_lo, csum_seed)
+                yield from self._walk_extents(lower_block, csum_seed, index_blocks)
+
+    def _read_extent(self, data, extent_block, csum_seed=None, progress=None):
+        for entry in self._walk_extents(extent_block, csum_seed):
+            _start = entry.ee_block * self._block_size
+            _size = entry.ee_len * self._block_size
+            self._ext4.seek(entry.ee_start_lo * self._block_size)
+            for _offset in range(_start, _start + _size, __READ_CHUNK__):
+                chunk = self._ext4.read(min(__READ_CHUNK__, _start + _size - _offset))
+                data[_offset:_offset + len(chunk)] = chunk
+                if progress is not None:
+                    progress(len(chunk))
+
+    def _read_data(self, inode, inode_num=None, progress=None):
         data = b''
 
         if inode.i_size_lo == 0:
@@ -136,32 +245,97 @@ class Ext4(object):
             data = inode.i_block
         elif inode.i_flags & 0x80000:
             data = bytearray(inode.i_size_lo)
-            self._read_extent(data, inode.i_block)
+            csum_seed = None
+            if self._verifying and inode_num is not None:
+                csum_seed = self._inode_csum_seed(inode_num, inode)
+            self._read_extent(data, inode.i_block, csum_seed, progress)
         else:
             raise RuntimeError("Mapped Inodes are not supported")
 
         return data
 
-    def load(self, filename):
-        self._ext4 = open(filename, "rb")
+    def _replay_journal(self):
+        journal_inum = self._superblock.s_journal_inum
+        if journal_inum == 0:
+            raise RuntimeError("External journals are not supported")
+        inode = self._read_inode(journal_inum)
+        if not inode.i_flags & 0x80000:
+            raise RuntimeError("Mapped journal inodes are not supported")
+        extents = []
+        for entry in self._walk_extents(inode.i_block):
+            extents.append((entry.ee_block, entry.ee_len, entry.ee_start_lo))
+        journal = Journal(self._ext4, self._block_size, extents)
+        remap = journal.replay()
+        self._journal_errors = journal.errors
+        if remap:
+            self._ext4 = JournalOverlay(self._ext4, self._block_size, remap)
+
+    def _load_superblock(self):
         self._ext4.seek(1024)
-        self._superblock = make_superblock(self._ext4.read(256))
+        sb_raw = self._ext4.read(1024)
+        self._superblock = make_superblock(sb_raw[:256])
         if self._superblock.s_magic != 0xef53:
             raise RuntimeError("Bad superblock magic")
         incompat = self._superblock.s_feature_incompat
-        for f_id in [0x1, 0x4, 0x10, 0x80, 0x200, 0x1000, 0x4000, 0x10000]:
-            if incompat & f_id:
-                raise RuntimeError("Unsupported feature ({:#x})".format(f_id))
         self._block_size = 2 ** (10 + self._superblock.s_log_block_size)
         if self._has_sparse_super2:
-            self._ext4.seek(0x64c)
-            self._backup_bgs = list(unpack('<2I', self._ext4.read(8)))
+            self._backup_bgs = list(unpack('<2I', sb_raw[0x24c:0x254]))
         else:
             self._backup_bgs = []
+        self._csum_seed = None
+        self._csum_errors = []
+        self._csum_failed = set()
+        self._verified_bgs = set()
+        self._inode_seeds = {}
+        if self._verify and self._has_metadata_csum:
+            if incompat & 0x2000:
+                self._csum_seed, = unpack('<I', sb_raw[0x270:0x274])
+            else:
+                self._csum_seed = crc32c(0xffffffff, self._superblock.s_uuid)
+            stored, = unpack('<I', sb_raw[0x3fc:0x400])
+            self._check_csum("superblock", stored, crc32c(0xffffffff, sb_raw[:0x3fc]))
+
+    def load(self, filename):
+        self._ext4 = open(filename, "rb")
+        self._block_map = None
+        self._journal_errors = []
+        self._load_superblock()
+        incompat = self._superblock.s_feature_incompat
+        unsupported = [0x1, 0x10, 0x80, 0x200, 0x1000, 0x4000, 0x10000]
+        if not self._replay:
+            unsupported.append(0x4)
+        for f_id in unsupported:
+            if incompat & f_id:
+                raise RuntimeError("Unsupported feature ({:#x})".format(f_id))
+        if incompat & 0x4:
+            self._replay_journal()
+            self._load_superblock()
+
+    @property
+    def verifying(self):
+        return self._verifying
+
+    @property
+    def journal_errors(self):
+        return self._journal_errors
+
+    def pop_checksum_errors(self):
+        errors, self._csum_errors = self._csum_errors, []
+        return errors
+
+    def close(self):
+        if self._ext4 is not None:
+            self._ext4.close()
+            self._ext4 = None
 
     def read_dir(self, inode_num):
         inode = self._read_inode(inode_num)
-        dir_raw = self._read_data(inode)
+        dir_raw = self._read_data(inode, inode_num)
+        if self._verifying:
+            csum_seed = self._inode_csum_seed(inode_num, inode)
+            for lblk in range(0, len(dir_raw) // self._block_size):
+                dir_block = dir_raw[lblk * self._block_size:(lblk + 1) * self._block_size]
+                self._verify_dir_block(dir_block, inode_num, lblk, csum_seed, bool(inode.i_flags & 0x1000))
         dir_data = list()
         offset = 0
         while offset < len(dir_raw):
@@ -169,13 +343,19 @@ class Ext4(object):
             entry = DirEntry()
             if self._superblock.s_feature_incompat & 0x2:
                 dir_entry = make_dir_entry_v2(entry_raw)
-                if dir_entry.inode == 0:
+                if dir_entry.rec_len == 0:
                     break
+                if dir_entry.inode == 0:
+                    offset += dir_entry.rec_len
+                    continue
                 entry.type = dir_entry.file_type
             else:
                 dir_entry = make_dir_entry(entry_raw)
-                if dir_entry.inode == 0:
+                if dir_entry.rec_len == 0:
                     break
+                if dir_entry.inode == 0:
+                    offset += dir_entry.rec_len
+                    continue
                 entry_inode = self._read_inode(dir_entry.inode)
                 inode_type = entry_inode.i_mode & 0xf000
                 if inode_type == 0x1000:
@@ -198,13 +378,13 @@ class Ext4(object):
             offset += dir_entry.rec_len
         return dir_data
 
-    def read_file(self, inode_num):
+    def read_file(self, inode_num, progress=None):
         inode = self._read_inode(inode_num)
-        return self._read_data(inode)[:inode.i_size_lo], inode.i_atime, inode.i_mtime
+        return self._read_data(inode, inode_num, progress)[:inode.i_size_lo], inode.i_atime, inode.i_mtime
 
     def read_link(self, inode_num):
         inode = self._read_inode(inode_num)
-        return self._read_data(inode)[:inode.i_size_lo].decode('utf-8')
+        return self._read_data(inode, inode_num)[:inode.i_size_lo].decode('utf-8')
 
     def read_xattr(self, inode, extra=None):
         xattr = {}
@@ -224,6 +404,10 @@ class Ext4(object):
             if xattr_hdr.h_magic != 0xea020000:
                 raise RuntimeError("Bad xattr magic")
             xattr_data = self._ext4.read((self._block_size * xattr_hdr.h_blocks) - 32)
+            if self._verifying:
+                csum = crc32c(self._csum_seed, pack('<Q', inode.i_file_acl_lo))
+                csum = crc32c(csum, hdr_raw[:0x10] + b'\0' * 4 + hdr_raw[0x14:] + xattr_data)
+                self._check_csum("xattr block {}".format(inode.i_file_acl_lo), xattr_hdr.h_checksum, csum)
             xattr.update(self._parse_xattr(hdr_raw + xattr_data, 32))
 
         return xattr
@@ -251,7 +435,7 @@ class Ext4(object):
             offset += entry.e_name_len
 
             if entry.e_value_inum:
-                value = self._read_data(self._read_inode(entry.e_value_inum))
+                value = self._read_data(self._read_inode(entry.e_value_inum), entry.e_value_inum)
             else:
                 value = xattr_data[entry.e_value_offs:entry.e_value_offs + entry.e_value_size]
             if value == b'':
@@ -275,6 +459,138 @@ class Ext4(object):
             mode=inode.i_mode & 0xfff,
             xattr=self.read_xattr(inode, extra))
 
+    def scan_usage(self):
+        sb = self._superblock
+        groups = (sb.s_blocks_count_lo - sb.s_first_data_block + sb.s_blocks_per_group - 1) // sb.s_blocks_per_group
+        files = 0
+        symlinks = 0
+        size = 0
+        for bg_num in range(groups):
+            group_desc = self._read_group_descriptor(bg_num)
+            if group_desc.bg_flags & 0x1:  # INODE_UNINIT
+                continue
+            count = sb.s_inodes_per_group
+            if sb.s_feature_ro_compat & 0x410:
+                count -= group_desc.bg_itable_unused_lo
+            self._ext4.seek(group_desc.bg_inode_bitmap_lo * self._block_size)
+            bitmap = self._ext4.read((count + 7) // 8)
+            self._ext4.seek(group_desc.bg_inode_table_lo * self._block_size)
+            table = self._ext4.read(count * sb.s_inode_size)
+            for idx in range(count):
+                if not bitmap[idx >> 3] & (1 << (idx & 7)):
+                    continue
+                if bg_num * sb.s_inodes_per_group + idx + 1 < sb.s_first_ino:
+                    continue
+                i_mode, _, i_size_lo = unpack_from('<HHI', table, idx * sb.s_inode_size)
+                i_links_count, = unpack_from('<H', table, idx * sb.s_inode_size + 26)
+                # extraction writes every hard link, and orphans (no links) are never reached
+                if i_mode & 0xf000 == 0x8000:
+                    files += i_links_count
+                    size += i_size_lo * i_links_count
+                elif i_mode & 0xf000 == 0xa000:
+                    symlinks += i_links_count
+        return files, symlinks, size
+
+    def _group_bitmap(self, bg_num, group_start, group_blocks):
+        group_desc = self._read_group_descriptor(bg_num)
+        if group_desc.bg_flags & 0x2 and self._superblock.s_feature_ro_compat & 0x410:  # BLOCK_UNINIT
+            bitmap = 0
+            if self._bg_has_super(bg_num):
+                groups = (self._superblock.s_blocks_count_lo - self._superblock.s_first_data_block
+                          + self._superblock.s_blocks_per_group - 1) // self._superblock.s_blocks_per_group
+                gdt_blocks = (groups * self._desc_size + self._block_size - 1) // self._block_size
+                bitmap |= (1 << (1 + gdt_blocks + self._superblock.s_reserved_gdt_blocks)) - 1
+            table_blocks = (self._superblock.s_inodes_per_group * self._superblock.s_inode_size
+                            + self._block_size - 1) // self._block_size
+            for start, count in ((group_desc.bg_block_bitmap_lo, 1),
+                                 (group_desc.bg_inode_bitmap_lo, 1),
+                                 (group_desc.bg_inode_table_lo, table_blocks)):
+                if group_start <= start < group_start + group_blocks:
+                    bitmap |= ((1 << count) - 1) << (start - group_start)
+        else:
+            self._ext4.seek(group_desc.bg_block_bitmap_lo * self._block_size)
+            bitmap = int.from_bytes(self._ext4.read((group_blocks + 7) // 8), 'little')
+        return bitmap & ((1 << group_blocks) - 1)
+
+    def allocated_runs(self):
+        sb = self._superblock
+        if sb.s_feature_ro_compat & 0x200:
+            raise RuntimeError("Unsupported feature (bigalloc)")
+        run_start, run_len = 0, sb.s_first_data_block
+        for group_start in range(sb.s_first_data_block, sb.s_blocks_count_lo, sb.s_blocks_per_group):
+            bg_num = (group_start - sb.s_first_data_block) // sb.s_blocks_per_group
+            group_blocks = min(sb.s_blocks_per_group, sb.s_blocks_count_lo - group_start)
+            bitmap = self._group_bitmap(bg_num, group_start, group_blocks)
+            edges = bitmap ^ (bitmap << 1)
+            while edges:
+                low = edges & -edges
+                start = group_start + low.bit_length() - 1
+                edges ^= low
+                low = edges & -edges
+                end = group_start + low.bit_length() - 1
+                edges ^= low
+                if run_start + run_len == start:
+                    run_len += end - start
+                    continue
+                if run_len:
+                    yield run_start, run_len
+                run_start, run_len = start, end - start
+        if run_len:
+            yield run_start, run_len
+
+    def export(self, filename, android_sparse=False):
+        runs = list(self.allocated_runs())
+        total_blocks = self._superblock.s_blocks_count_lo
+        with open(filename, "wb") as out:
+            if android_sparse:
+                write_android_sparse(self._ext4, out, self._block_size, total_blocks, runs)
+            else:
+                write_sparse_raw(self._ext4, out, self._block_size, total_blocks, runs)
+        return sum(count for _, count in runs), total_blocks
+
+    def _map_inode(self, block_map, inode_num, path):
+        inode = self._read_inode(inode_num)
+        block_map.set_path(inode_num, path)
+        if inode.i_file_acl_lo:
+            block_map.add(inode.i_file_acl_lo, 1, inode_num)
+        if inode.i_flags & 0x10000000 or not inode.i_flags & 0x80000:
+            return
+        index_blocks = []
+        for entry in self._walk_extents(inode.i_block, index_blocks=index_blocks):
+            length = entry.ee_len if entry.ee_len <= 32768 else entry.ee_len - 32768
+            block_map.add(entry.ee_start_lo, length, inode_num)
+        for block in index_blocks:
+            block_map.add(block, 1, inode_num)
+
+    def _map_dir(self, block_map, inode_num, path):
+        for de in self.read_dir(inode_num):
+            if de.name == '.' or de.name == '..' or block_map.has_inode(de.inode):
+                continue
+            entry_path = path + '/' + de.name
+            self._map_inode(block_map, de.inode, entry_path)
+            if de.type == 2:
+                self._map_dir(block_map, de.inode, entry_path)
+
+    def build_block_map(self):
+        block_map = BlockMap()
+        if self._superblock.s_journal_inum:
+            self._map_inode(block_map, self._superblock.s_journal_inum, "<journal>")
+        self._map_inode(block_map, 2, "/")
+        self._map_dir(block_map, 2, "")
+        block_map.sort()
+        self._block_map = block_map
+        return block_map
+
+    def owner_of(self, block):
+        if self._block_map is None:
+            self.build_block_map()
+        return self._block_map.owner_of(block)
+
+    def owners_of(self, first, last):
+        if self._block_map is None:
+            self.build_block_map()
+        return self._block_map.overlapping(first, last)
+
     @property
     def root(self):
         return self.read_dir(2)
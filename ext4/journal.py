@@ -0,0 +1,218 @@
+"""
+    ext4extract - Ext4 data extracting tool
+    Copyright (C) 2017, HexEdit (IFProject)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from bisect import bisect_left, bisect_right
+from struct import pack, unpack_from
+
+from .structs import *
+from .crc32c import crc32c
+
+
+__JBD2_MAGIC__ = 0xc03b3998
+
+
+class Journal(object):
+    """Parser for an internal jbd2 journal, stored as a file with the given extents."""
+
+    def __init__(self, device, block_size, extents):
+        self._device = device
+        self._block_size = block_size
+        self._extents = sorted(extents)
+        self._starts = [start for start, _, _ in self._extents]
+        self._first = 0
+        self._last = 0
+        self._csum_seed = None
+        self._errors = []
+
+    @property
+    def errors(self):
+        return self._errors
+
+    def _bmap(self, lblk):
+        idx = bisect_right(self._starts, lblk) - 1
+        if idx >= 0:
+            start, length, pblk = self._extents[idx]
+            if lblk < start + length:
+                return pblk + (lblk - start)
+        raise RuntimeError("Journal block {} is not mapped".format(lblk))
+
+    def _read_block(self, lblk):
+        self._device.seek(self._bmap(lblk) * self._block_size)
+        return self._device.read(self._block_size)
+
+    def _block_csum_ok(self, block, csum_offset):
+        stored, = unpack_from('>I', block, csum_offset)
+        csum_block = bytearray(block)
+        csum_block[csum_offset:csum_offset + 4] = bytes(4)
+        return crc32c(self._csum_seed, csum_block) == stored
+
+    def _next(self, lblk):
+        lblk += 1
+        return self._first if lblk >= self._last else lblk
+
+    def replay(self):
+        """Scan the log and return {fs block: (device block, escaped)} for the committed transactions."""
+        sb = make_journal_superblock(self._read_block(0)[:88])
+        if sb.h_magic != __JBD2_MAGIC__ or sb.h_blocktype not in (3, 4):
+            raise RuntimeError("Bad journal superblock magic")
+        if sb.s_start == 0:
+            return {}
+        if sb.s_blocksize != self._block_size:
+            raise RuntimeError("Journal block size differs from file system block size")
+
+        incompat = sb.s_feature_incompat if sb.h_blocktype == 4 else 0
+        if incompat & ~0x3f:
+            raise RuntimeError("Unsupported journal feature ({:#x})".format(incompat & ~0x3f))
+        has_64bit = bool(incompat & 0x2)
+        has_csum_v2 = bool(incompat & 0x8)
+        has_csum_v3 = bool(incompat & 0x10)
+        if has_csum_v3:
+            tag_bytes = 16
+        else:
+            tag_bytes = 8 + (2 if has_csum_v2 else 0) + (4 if has_64bit else 0)
+        tail_bytes = 4 if has_csum_v2 or has_csum_v3 else 0
+        if tail_bytes:
+            if sb.s_checksum_type != 4:
+                raise RuntimeError("Unsupported journal checksum type ({})".format(sb.s_checksum_type))
+            self._csum_seed = crc32c(0xffffffff, sb.s_uuid)
+
+        self._first = sb.s_first
+        self._last = sb.s_maxlen
+        if incompat & 0x20:
+            self._last -= sb.s_num_fc_blks or 256
+
+        transactions = []
+        revoked = {}
+        tags, revokes, bad_tags = [], [], []
+        seq, lblk = sb.s_sequence, sb.s_start
+        for _ in range(self._last - self._first):
+            block = self._read_block(lblk)
+            hdr = make_journal_header(block[:12])
+            if hdr.h_magic != __JBD2_MAGIC__ or hdr.h_sequence != seq:
+                break
+            if hdr.h_blocktype in (1, 5) and tail_bytes \
+                    and not self._block_csum_ok(block, self._block_size - 4):
+                self._errors.append("transaction {}: {} block checksum mismatch, end of log".format(
+                    seq, "descriptor" if hdr.h_blocktype == 1 else "revoke"))
+                break
+            if hdr.h_blocktype == 2 and tail_bytes and not self._block_csum_ok(block, 16):
+                self._errors.append("transaction {}: commit block checksum mismatch, end of log".format(seq))
+                break
+            if hdr.h_blocktype == 1:  # descriptor
+                offset = 12
+                while offset + tag_bytes <= self._block_size - tail_bytes:
+                    if has_csum_v3:
+                        blocknr, flags, blocknr_high, tag_csum = unpack_from('>IIII', block, offset)
+                    else:
+                        blocknr, tag_csum, flags = unpack_from('>IHH', block, offset)
+                        blocknr_high = unpack_from('>I', block, offset + 8)[0] if has_64bit else 0
+                    if has_64bit:
+                        blocknr |= blocknr_high << 32
+                    lblk = self._next(lblk)
+                    if tail_bytes:
+                        csum = crc32c(crc32c(self._csum_seed, pack('>I', seq)), self._read_block(lblk))
+                        if tag_csum != (csum if has_csum_v3 else csum & 0xffff):
+                            bad_tags.append(blocknr)
+                        else:
+                            tags.append((blocknr, lblk, bool(flags & 0x1)))
+                    else:
+                        tags.append((blocknr, lblk, bool(flags & 0x1)))
+                    offset += tag_bytes
+                    if not flags & 0x2:
+                        offset += 16
+                    if flags & 0x8:
+                        break
+            elif hdr.h_blocktype == 2:  # commit
+                transactions.append((seq, tags))
+                for blocknr in revokes:
+                    revoked[blocknr] = seq
+                for blocknr in bad_tags:
+                    self._errors.append("transaction {}: checksum mismatch in journalled copy of block {}, "
+                                        "keeping the original".format(seq, blocknr))
+                tags, revokes, bad_tags = [], [], []
+                seq += 1
+            elif hdr.h_blocktype == 5:  # revoke
+                r_count, = unpack_from('>I', block, 12)
+                rec = 8 if has_64bit else 4
+                for offset in range(16, min(r_count, self._block_size - tail_bytes), rec):
+                    revokes.append(unpack_from('>Q' if has_64bit else '>I', block, offset)[0])
+            else:
+                break
+            lblk = self._next(lblk)
+
+        remap = {}
+        for tseq, tags in transactions:
+            for blocknr, jblk, escaped in tags:
+                if revoked.get(blocknr, tseq - 1) >= tseq:
+                    continue
+                remap[blocknr] = (self._bmap(jblk), escaped)
+        return remap
+
+
+class JournalOverlay(object):
+    """Read-only file-like view of the device with replayed journal blocks in place of the originals."""
+
+    def __init__(self, device, block_size, remap):
+        self._device = device
+        self._block_size = block_size
+        self._remap = remap
+        self._blocks = sorted(remap)
+        self._pos = 0
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += self._device.seek(0, 2)
+        self._pos = offset
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def read(self, size=-1):
+        start = self._pos
+        self._device.seek(start)
+        data = self._device.read(size)
+        if size < 0:
+            size = len(data)
+        end = start + size
+        idx = bisect_left(self._blocks, start // self._block_size)
+        if size == 0 or idx == len(self._blocks) or self._blocks[idx] * self._block_size >= end:
+            self._pos += len(data)
+            return data
+
+        data = bytearray(data)
+        while idx < len(self._blocks) and self._blocks[idx] * self._block_size < end:
+            blocknr = self._blocks[idx]
+            jblk, escaped = self._remap[blocknr]
+            self._device.seek(jblk * self._block_size)
+            block = bytearray(self._device.read(self._block_size))
+            if escaped:
+                block[:4] = pack('>I', __JBD2_MAGIC__)
+            lo = max(start, blocknr * self._block_size)
+            hi = min(end, (blocknr + 1) * self._block_size)
+            if len(data) < hi - start:
+                data.extend(bytes(hi - start - len(data)))
+            data[lo - start:hi - start] = block[lo - blocknr * self._block_size:hi - blocknr * self._block_size]
+            idx += 1
+        self._pos += len(data)
+        return bytes(data)
+
+    def close(self):
+        self._device.close()
@@ -0,0 +1,91 @@
+"""
+    ext4extract - Ext4 data extracting tool
+    Copyright (C) 2017, HexEdit (IFProject)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os
+from struct import pack
+
+
+__SPARSE_HEADER_PACK__ = "<IHHHHIIII"
+__SPARSE_CHUNK_PACK__ = "<HHII"
+__SPARSE_MAGIC__ = 0xed26ff3a
+__CHUNK_TYPE_RAW__ = 0xcac1
+__CHUNK_TYPE_DONT_CARE__ = 0xcac3
+__COPY_CHUNK__ = 16 * 2 ** 20
+
+
+def _copy(device, out, offset, size, out_offset):
+    if hasattr(device, 'fileno') and hasattr(os, 'copy_file_range'):
+        out.flush()
+        try:
+            while size > 0:
+                copied = os.copy_file_range(device.fileno(), out.fileno(), min(size, 2 ** 30), offset, out_offset)
+                if copied == 0:
+                    break
+                offset += copied
+                out_offset += copied
+                size -= copied
+        except OSError:
+            pass
+    if size > 0:
+        device.seek(offset)
+        out.seek(out_offset)
+        while size > 0:
+            data = device.read(min(size, __COPY_CHUNK__))
+            if not data:
+                out.write(bytes(size))
+                break
+            out.write(data)
+            size -= len(data)
+
+
+def write_sparse_raw(device, out, block_size, total_blocks, runs):
+    """Copy allocated runs to their offsets in out and leave everything else as holes."""
+    for start, count in runs:
+        _copy(device, out, start * block_size, count * block_size, start * block_size)
+    out.truncate(total_blocks * block_size)
+
+
+def write_android_sparse(device, out, block_size, total_blocks, runs):
+    """Write allocated runs as RAW chunks and the gaps between them as DONT_CARE chunks."""
+    chunks = []
+    block = 0
+    for start, count in runs:
+        if start > block:
+            chunks.append((__CHUNK_TYPE_DONT_CARE__, start - block, 0))
+        block = start + count
+        while count > 0:
+            chunk = min(count, 2 ** 30 // block_size)
+            chunks.append((__CHUNK_TYPE_RAW__, chunk, start))
+            start += chunk
+            count -= chunk
+    if total_blocks > block:
+        chunks.append((__CHUNK_TYPE_DONT_CARE__, total_blocks - block, 0))
+
+    out.write(pack(__SPARSE_HEADER_PACK__, __SPARSE_MAGIC__, 1, 0, 28, 12,
+                   block_size, total_blocks, len(chunks), 0))
+    out_offset = 28
+    for chunk_type, count, start in chunks:
+        out.seek(out_offset)
+        if chunk_type == __CHUNK_TYPE_RAW__:
+            out.write(pack(__SPARSE_CHUNK_PACK__, chunk_type, 0, count, 12 + count * block_size))
+            _copy(device, out, start * block_size, count * block_size, out_offset + 12)
+            out_offset += 12 + count * block_size
+        else:
+            out.write(pack(__SPARSE_CHUNK_PACK__, chunk_type, 0, count, 12))
+            out_offset += 12
+    out.truncate(out_offset)
@@ -30,6 +30,8 @@ __DIR_ENTRY_PACK__ = "<IHH"
 __DIR_ENTRY_V2_PACK__ = "<IHBB"
 __XATTR_HEADER_PACK__ = "<IIIII12s"
 __XATTR_ENTRY_PACK__ = "<BBHIII"
+__JOURNAL_HEADER_PACK__ = ">III"
+__JOURNAL_SUPERBLOCK_PACK__ = ">IIIIIIIIIIII16sIIIIB3xI"
 
 __SuperBlock__ = namedtuple('Ext4SuperBlock', """
     s_inodes_count
@@ -169,6 +171,34 @@ __XattrEntry__ = namedtuple('Ext4XattrEntry', """
     e_hash
 """)
 
+__JournalHeader__ = namedtuple('Jbd2Header', """
+    h_magic
+    h_blocktype
+    h_sequence
+""")
+
+__JournalSuperBlock__ = namedtuple('Jbd2SuperBlock', """
+    h_magic
+    h_blocktype
+    h_sequence
+    s_blocksize
+    s_maxlen
+    s_first
+    s_sequence
+    s_start
+    s_errno
+    s_feature_compat
+    s_feature_incompat
+    s_feature_ro_compat
+    s_uuid
+    s_nr_users
+    s_dynsuper
+    s_max_transaction
+    s_max_trans_data
+    s_checksum_type
+    s_num_fc_blks
+""")
+
 
 def make_superblock(data):
     return __SuperBlock__._make(unpack(__SUPERBLOCK_PACK__, data))
@@ -208,3 +238,11 @@ def make_xattr_header(data):
 
 def make_xattr_entry(data):
     return __XattrEntry__._make(unpack(__XATTR_ENTRY_PACK__, data))
+
+
+def make_journal_header(data):
+    return __JournalHeader__._make(unpack(__JOURNAL_HEADER_PACK__, data))
+
+
+def make_journal_superblock(data):
+    return __JournalSuperBlock__._make(unpack(__JOURNAL_SUPERBLOCK_PACK__, data))
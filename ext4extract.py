@@ -29,4 +29,4 @@ def exception_handler(exception_type, exception, traceback):
 
 if __name__ == '__main__':
     sys.excepthook = exception_handler
-    Application().run()
+    sys.exit(Application().run())
@@ -0,0 +1,100 @@
+"""
+    ext4extract - Ext4 data extracting tool
+    Copyright (C) 2017, HexEdit (IFProject)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import json
+import os
+import time
+
+
+class Progress(object):
+    """Rate-limited progress reporter writing to a stream and/or a JSON status file."""
+
+    def __init__(self, total_files, total_bytes, stream=None, status_file=None, interval=1.0):
+        self._total_files = total_files
+        self._total_bytes = total_bytes
+        self._stream = stream
+        self._status_file = status_file
+        self._interval = interval
+        self._start = time.monotonic()
+        self._next = self._start + interval
+        self._last_time = self._start
+        self._last_bytes = 0
+        self._rate = None
+        self._files = 0
+        self._bytes = 0
+
+    def _format_eta(self, eta):
+        if eta is None:
+            return "--:--:--"
+        eta = int(eta)
+        return "{}:{:02}:{:02}".format(eta // 3600, eta // 60 % 60, eta % 60)
+
+    def _report(self, now, done=False):
+        elapsed = now - self._start
+        if done:
+            self._rate = self._bytes / elapsed if elapsed > 0 else None
+        elif now > self._last_time:
+            current = (self._bytes - self._last_bytes) / (now - self._last_time)
+            self._rate = current if self._rate is None else 0.3 * current + 0.7 * self._rate
+        self._last_time = now
+        self._last_bytes = self._bytes
+        remaining = max(self._total_bytes - self._bytes, 0)
+        eta = 0.0 if done else (remaining / self._rate if self._rate else None)
+
+        if self._stream is not None:
+            percent = 100.0 * self._bytes / self._total_bytes if self._total_bytes else 100.0
+            line = "{files}/{total_files} files, {mib:.1f}/{total_mib:.1f} MiB ({percent:.1f}%), " \
+                   "{rate:.1f} MiB/s, ETA {eta}".format(
+                    files=self._files,
+                    total_files=self._total_files,
+                    mib=self._bytes / 2 ** 20,
+                    total_mib=self._total_bytes / 2 ** 20,
+                    percent=min(percent, 100.0),
+                    rate=(self._rate or 0.0) / 2 ** 20,
+                    eta=self._format_eta(eta))
+            if self._stream.isatty():
+                self._stream.write("\r\033[K" + line + ("\n" if done else ""))
+            else:
+                self._stream.write(line + "\n")
+            self._stream.flush()
+
+        if self._status_file is not None:
+            status = {
+                'files': self._files,
+                'total_files': self._total_files,
+                'bytes': self._bytes,
+                'total_bytes': self._total_bytes,
+                'elapsed': round(elapsed, 3),
+                'rate': round(self._rate or 0.0, 1),
+                'eta': None if eta is None else round(eta, 1),
+                'done': done
+            }
+            with open(self._status_file + ".tmp", "w") as status_file:
+                json.dump(status, status_file)
+            os.replace(self._status_file + ".tmp", self._status_file)
+
+    def update(self, files, size):
+        self._files = files
+        self._bytes = size
+        now = time.monotonic()
+        if now >= self._next:
+            self._next = now + self._interval
+            self._report(now)
+
+    def finish(self):
+        self._report(time.monotonic(), done=True)